@@ -94,9 +94,10 @@ def evaluate_search(
     # TODO: support evaluation on training split
     use_full_set = gallery_size == -1
     fname = "TestG{}".format(gallery_size if not use_full_set else 50)
-    protoc = loadmat(osp.join(dataset.root_dir, "annotation/test/train_test", fname + ".mat"))[
-        fname
-    ].squeeze()
+    protoc = loadmat(
+        osp.join(dataset.root_dir, "annotation/test/train_test", fname + ".mat"),
+        variable_names=[fname],
+    )[fname].squeeze()
 
     # mapping from gallery image to (det, feat)
     name_to_det_feat = {}
@@ -1,7 +1,9 @@
 import logging
+import mmap
 import os
 import os.path as osp
 import pickle as pk
+import struct
 
 import coloredlogs
 import torch
@@ -43,14 +45,48 @@ def torch_rand_choice(arr, size):
 
 
 def pickle(data, file_path):
+    """
+    Pickle data to a file.
+
+    With pickle protocol 5 (Python >= 3.8), large buffers such as ndarrays are
+    written out-of-band to a ".buf" sidecar file, which unpickle memory-maps so
+    loading a cache does not copy the array data.
+    """
+    if pk.HIGHEST_PROTOCOL < 5:
+        with open(file_path, "wb") as f:
+            pk.dump(data, f, pk.HIGHEST_PROTOCOL)
+        return
+    buffers = []
     with open(file_path, "wb") as f:
-        pk.dump(data, f, pk.HIGHEST_PROTOCOL)
+        pk.dump(data, f, 5, buffer_callback=buffers.append)
+    raws = [buf.raw() for buf in buffers]
+    with open(file_path + ".buf", "wb") as f:
+        f.write(struct.pack("<q", len(raws)))
+        f.write(struct.pack("<%dq" % len(raws), *[raw.nbytes for raw in raws]))
+        for raw in raws:
+            f.write(raw)
 
 
 def unpickle(file_path):
+    """
+    Unpickle data from a file, memory-mapping the out-of-band buffer sidecar
+    written by pickle if one exists.
+    """
+    buf_file = file_path + ".buf"
+    if not osp.isfile(buf_file):
+        with open(file_path, "rb") as f:
+            return pk.load(f)
+    with open(buf_file, "rb") as f:
+        num_buffers = struct.unpack("<q", f.read(8))[0]
+        lengths = struct.unpack("<%dq" % num_buffers, f.read(8 * num_buffers))
+        mapped = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    buffers = []
+    offset = 8 * (num_buffers + 1)
+    for length in lengths:
+        buffers.append(mapped[offset : offset + length])
+        offset += length
     with open(file_path, "rb") as f:
-        data = pk.load(f)
-    return data
+        return pk.load(f, buffers=buffers)
 
 
 def init_logger(file_name, level="INFO"):